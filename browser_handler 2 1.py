@@ -1,12 +1,30 @@
+import base64
+import glob
 import io
+import itertools
 import math
 import os
+import random
 import shutil
+import tempfile
 import time
 import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 from PIL import Image
+try:
+    # Linux only, used to get notified as soon as the browser finishes writing the screenshot file
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
 from selenium import webdriver
+from selenium.common.exceptions import (InvalidSessionIdException, NoSuchWindowException, TimeoutException,
+                                        WebDriverException)
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
 from . import browser_options
 from .utils.helper import ScreenshotHelper
@@ -14,6 +32,80 @@ from wa.core.logging.logger import StandardOutLoggingHandler
 
 log = StandardOutLoggingHandler("wa.browser_handler").get_logger()
 
+# Marker file dropped in the temporary browser profiles we create so that leftovers can be found and swept
+PROFILE_MARKER = ".pagecapture-profile"
+
+# Files Firefox keeps in a profile directory while it is running
+FIREFOX_LOCK_FILES = ("lock", ".parentlock", "parent.lock")
+
+# Tallest canvas Firefox can render, Chrome's full page capture has a similar limit
+NATIVE_CAPTURE_MAX_HEIGHT = 32767
+
+# Seconds the async script timeout is kept above the longest wait for the page to settle
+SCRIPT_TIMEOUT_MARGIN = 5
+
+# Page heights closer than this are considered settled by get_max_height
+MAX_HEIGHT_EPSILON = 50
+
+# Removing a populated browser profile takes a while, it is done in the background so close() doesn't block
+_cleanup_pool = ThreadPoolExecutor(max_workers=2)
+_profiles_swept = False
+
+
+def _retry_with_backoff(fn, *, retries=5, base=1.0, cap=30.0, jitter=0.5,
+                        recoverable=(WebDriverException, TimeoutException), default=None, description='browser call'):
+    """
+    Calls `fn` until it succeeds, sleeping with exponential backoff and jitter between the attempts. A closed
+    window or a dead session can't recover, those are given up on right away.
+
+    :param fn: (callable)
+        - Called without arguments
+    :param retries: (int)
+        - Maximum number of attempts
+    :param base: (float)
+        - Delay in seconds after the first failed attempt, doubled after every further failure
+    :param cap: (float)
+        - Maximum delay in seconds
+    :param jitter: (float)
+        - Relative random variation applied to every delay
+    :param recoverable: (tuple)
+        - Exception types that are worth retrying
+    :param default:
+        - Returned when all the attempts failed
+    :param description: (str)
+        - Used in the log messages
+    :return:
+        - Result of `fn`, or `default`
+    """
+    for attempt in range(retries):
+        try:
+            return fn()
+        except (NoSuchWindowException, InvalidSessionIdException) as e:
+            log.error(f'{e}. Giving up on {description}, the browser session is gone')
+            return default
+        except recoverable as e:
+            if attempt == retries - 1:
+                log.error(f'{e}. Giving up on {description} after {retries} attempts')
+                return default
+            delay = min(cap, base * 2 ** attempt) * (1 + random.uniform(-jitter, jitter))
+            log.error(f'{e}. Retrying {description} in {delay:.2f} seconds')
+            time.sleep(delay)
+    return default
+
+
+def _decode_png(png_bytes):
+    """
+    Opens and fully decodes png bytes so that the decoding cost is paid by the calling thread.
+
+    :param png_bytes: (bytes)
+        - png data as returned by the webdriver
+    :return:
+        - decoded PIL Image
+    """
+    img = Image.open(io.BytesIO(png_bytes))
+    img.load()
+    return img
+
 
 class BrowserHandler:
     """
@@ -33,6 +125,10 @@ class BrowserHandler:
             - lowercase string to identify the browser that should be used
             - Accepted Values: chrome, firefox
 
+        :param browser_pool
+            - Optional BrowserPool, see BrowserHandler.acquire(). When set, no browser profile is created and the
+                browser session is borrowed from the pool instead.
+
         :param kwargs:
             - Any remaining kwargs will get passed on to the browser profile creation process
 
@@ -45,25 +141,71 @@ class BrowserHandler:
 
     """
 
+    # Observed settle time (seconds) of the last quiescence wait, keyed on URL host. Shared across handlers so that
+    # later captures of the same site can use a tighter wait budget.
+    _settle_times = {}
+
     def __init__(self, GECKO_DRIVER_LOG='/var/log/bmp/geckodriver.log', executable_path=None, browser_type='firefox',
-                 **kwargs):
+                 browser_pool=None, **kwargs):
         self.browser_type = browser_type
         self.executable_path = executable_path
         self.GECKO_DRIVER_LOG = GECKO_DRIVER_LOG
-        self.browser_profile = self._create_browser_profile(**kwargs)
-        if kwargs.get('persistent_session_cookie'):
-            self.browser_profile_loc = kwargs.get('profile_dir_start_mc')
+        self.browser_pool = browser_pool
+        if browser_pool:
+            # The pool owns the browser sessions along with their profiles
+            self.browser_profile = None
+            self.browser_profile_loc = None
         else:
-            self.browser_profile_loc = self.browser_profile.profile_dir
+            self._sweep_stale_profiles_once()
+            self.browser_profile = self._create_browser_profile(**kwargs)
+            if kwargs.get('persistent_session_cookie'):
+                self.browser_profile_loc = kwargs.get('profile_dir_start_mc')
+            else:
+                self.browser_profile_loc = self._mark_profile_dir(self.browser_profile)
         self.har_export_plugin_path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
                                                    "lib", "har_export_trigger-0.6.1-an+fx.xpi")
         self.kwargs = kwargs
+        self._current_host = None
+        # Async script timeout of the driver in seconds, starts at the W3C default and is raised when a wait for
+        # the page to settle needs more
+        self._script_timeout = 30
+        # Browser chrome height and viewport height, read once per capture
+        self._chrome_delta = None
+        self._viewport_h = None
+        # Screenshot slices are decoded in the background while the browser scrolls to the next slice
+        self._decode_pool = ThreadPoolExecutor(max_workers=2)
 
     def create_webdriver(self, seconds=60, **kwargs):
         self.webdriver = self._create_webdriver(**kwargs)
         self.set_page_timeout(seconds)
         self.name = '{}_webdriver'.format(self.browser_type)
 
+    @classmethod
+    def acquire(cls, pool, seconds=60, timeout=None, **kwargs):
+        """
+        Creates a handler around a warm browser session borrowed from the given BrowserPool instead of starting a
+        new browser. close() hands the session back to the pool.
+
+        :param pool:
+            - BrowserPool to borrow the browser session from
+        :param seconds:
+            - Page load timeout, see set_page_timeout()
+        :param timeout:
+            - Number of seconds to wait for a free session, waits forever when None
+        :param kwargs:
+            - Passed on to the BrowserHandler
+        """
+        handler = cls(browser_pool=pool, **kwargs)
+        handler.webdriver, handler.browser_profile_loc = pool.acquire(timeout)
+        try:
+            handler.set_page_timeout(seconds)
+        except Exception:
+            # don't lose the session, the pool replaces it if it is broken
+            handler.close()
+            raise
+        handler.name = '{}_webdriver'.format(handler.browser_type)
+        return handler
+
     # Private
     def _create_webdriver(self, **kwargs):
         """
@@ -110,6 +252,68 @@ class BrowserHandler:
             return browser_options.create_firefox_options(**kwargs)
         return None
 
+    @staticmethod
+    def _mark_profile_dir(profile):
+        """
+        Drops the PROFILE_MARKER file in a profile directory that selenium created in the temp directory, so it
+        can be recognized by sweep_stale_profiles(). The directory itself stays where it is, selenium's profile
+        object keeps paths into it. Profile directories outside of the temp directory were chosen by the user and
+        are left alone.
+
+        :param profile:
+            - Browser profile created by _create_browser_profile method
+        :return:
+            - Location of the profile directory
+        """
+        profile_dir = getattr(profile, 'profile_dir', None)
+        temp_dir = tempfile.gettempdir()
+        if not profile_dir or os.path.dirname(os.path.abspath(profile_dir)) != os.path.abspath(temp_dir):
+            return profile_dir
+
+        # The marker holds the path of the directory, the browser runs from a copy of the profile that also gets
+        # the marker and the sweep must only remove the directory we created
+        try:
+            with open(os.path.join(profile_dir, PROFILE_MARKER), 'w') as marker:
+                marker.write(os.path.abspath(profile_dir))
+        except OSError as e:
+            log.error(f"Couldn't mark browser profile {profile_dir} for cleanup. Error: {e}")
+        return profile_dir
+
+    @classmethod
+    def sweep_stale_profiles(cls, max_age_seconds=3600):
+        """
+        Removes temporary browser profiles left behind by earlier runs, e.g. when a crawl was killed before it
+        could clean up after itself.
+
+        :param max_age_seconds:
+            - Profiles that were not modified for this many seconds are removed
+        """
+        now = time.time()
+        for marker in glob.glob(os.path.join(tempfile.gettempdir(), "*", PROFILE_MARKER)):
+            profile_dir = os.path.dirname(marker)
+            try:
+                with open(marker) as marker_file:
+                    if marker_file.read() != os.path.abspath(profile_dir):
+                        continue
+                # a locked profile is in use by a running browser
+                if any(os.path.lexists(os.path.join(profile_dir, lock)) for lock in FIREFOX_LOCK_FILES):
+                    continue
+                if now - os.path.getmtime(profile_dir) > max_age_seconds:
+                    shutil.rmtree(profile_dir, ignore_errors=True)
+                    log.info(f"Removed stale browser profile {profile_dir}")
+            except OSError as e:
+                log.error(f"Couldn't remove stale browser profile {profile_dir}. Error: {e}")
+
+    @classmethod
+    def _sweep_stale_profiles_once(cls):
+        """
+        Sweeps stale profiles in the background the first time a handler is created in this process.
+        """
+        global _profiles_swept
+        if not _profiles_swept:
+            _profiles_swept = True
+            _cleanup_pool.submit(cls.sweep_stale_profiles)
+
     def set_page_timeout(self, seconds=60):
         """
         Method will set the number of seconds the webdriver will wait for the page to load.
@@ -155,29 +359,135 @@ class BrowserHandler:
          """
         if self.webdriver is None:
             raise TypeError("Webdriver object doesn't exist.")
-        return self.webdriver.execute_aysnc_script(script, *args)
+        return self.webdriver.execute_async_script(script, *args)
 
-    def _browser_wait(self, delay=0):
+    def _browser_wait(self, delay=0, predicate=None):
         """
-        This uses the implicitly_wait() setting in Selenium to force the browser into a 'wait' state that
-        does not break the connection between Selenium, the driver, and the browser. We set the wait time,
-        in seconds, make a purposefully fake element search and return from the search. The entire duration
-        last as long as the value that we set.
+        Waits on the browser without breaking the connection between Selenium, the driver, and the browser.
+        When a predicate is given we poll it with an explicit WebDriverWait and return as soon as it is truthy,
+        otherwise we simply pause for the given delay.
+
+        Example predicate waiting for the document to be loaded:
+            lambda d: d.execute_script("return document.readyState") == "complete"
 
         :param delay : (int)
-            - Number of seconds that webdriver.implicitly_wait() is set.
+            - Maximum number of seconds to wait, or the pause duration when no predicate is given.
+        :param predicate : (callable)
+            - Called with the webdriver, the wait ends once it returns a truthy value.
         :return:
             - Nothing
         """
-        if self.webdriver:
-            self.webdriver.implicitly_wait(delay)
-            try:
-                self.webdriver.find_element_by_id("dummy-element-lookup")
-            except:
-                pass
-            self.webdriver.implicitly_wait(0)
+        if not self.webdriver:
+            return
+
+        if predicate is None:
+            time.sleep(delay)
+            return
+
+        WebDriverWait(self.webdriver, delay, poll_frequency=0.1).until(predicate)
+
+    def _wait_until_quiescent(self, max_delay, quiet_ms=300):
+        """
+        Waits for the page to settle instead of sleeping for a fixed amount of time. The page is considered settled
+        once document.readyState is 'complete' and no DOM mutations or resource requests were observed for
+        `quiet_ms`. The wait never exceeds `max_delay`.
+
+        The observed settle time is cached per URL host and subsequent waits on the same host are capped at
+        1.5 times that value.
+
+        :param max_delay : (int)
+            - Maximum number of seconds to wait
+        :param quiet_ms : (int)
+            - Milliseconds without mutations or network activity before the page is considered settled
+        :return:
+            - Nothing
+        """
+        if not max_delay:
+            return
+
+        budget = max_delay
+        observed = self._settle_times.get(self._current_host)
+        if observed is not None:
+            budget = min(observed * 1.5, max_delay)
+
+        js_script = """
+            var maxMs = arguments[0], quietMs = arguments[1], done = arguments[arguments.length - 1];
+            var start = performance.now(), last = start;
+            var touch = function () { last = performance.now(); };
+            var mutationObserver = new MutationObserver(touch);
+            mutationObserver.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+            var resourceObserver = null;
+            try {
+                resourceObserver = new PerformanceObserver(touch);
+                resourceObserver.observe({entryTypes: ['resource']});
+            } catch (e) {
+                resourceObserver = null;
+            }
+            var check = function () {
+                var now = performance.now();
+                var settled = document.readyState === 'complete' && now - last >= quietMs;
+                if (settled || now - start >= maxMs) {
+                    mutationObserver.disconnect();
+                    if (resourceObserver) {
+                        resourceObserver.disconnect();
+                    }
+                    done(now - start);
+                    return;
+                }
+                setTimeout(check, 50);
+            };
+            setTimeout(check, 50);
+            """
+        started = time.monotonic()
+        try:
+            # the driver gives up on async scripts after the script timeout, make sure it outlasts the budget
+            if budget + SCRIPT_TIMEOUT_MARGIN > self._script_timeout:
+                self._script_timeout = budget + SCRIPT_TIMEOUT_MARGIN
+                self.webdriver.set_script_timeout(self._script_timeout)
+            elapsed_ms = self.execute_async_script(js_script, int(budget * 1000), quiet_ms)
+        except Exception as e:
+            # only sleep for what is left of the delay, the failed wait may already have used some or all of it
+            remaining = max_delay - (time.monotonic() - started)
+            log.error(f"Couldn't wait for the page to settle, falling back to a fixed delay. Error: {e}")
+            if remaining > 0:
+                time.sleep(remaining)
+            return
+
+        if self._current_host:
+            self._settle_times[self._current_host] = max(float(elapsed_ms or 0) / 1000, quiet_ms / 1000)
 
-        return
+    def __get_page_geometry(self):
+        """
+        Reads the page geometry in a single round-trip to the driver.
+        The page height is the highest of the document height(html) and the body height.
+
+        Returns: (dict)
+            - max_height, page_y_offset, inner_height and outer_height of the current page
+        """
+        body_height, document_height, page_y_offset, inner_height, outer_height = self.execute_script(
+            "return [document.body.scrollHeight, document.documentElement.scrollHeight, window.pageYOffset, "
+            "window.innerHeight, window.outerHeight]")
+
+        max_height = max([int(body_height), int(document_height)])
+        log.info(f"GAH:: Found body height {body_height}, document height {document_height}, "
+                 f"used max height: {max_height}")
+
+        return {
+            'max_height': max_height,
+            'page_y_offset': page_y_offset,
+            'inner_height': inner_height,
+            'outer_height': outer_height,
+        }
+
+    def __load_window_metrics(self):
+        """
+        Reads the browser chrome height (outer minus inner window height) and the viewport height in a single
+        round-trip. Neither changes while scrolling, so the screenshot methods read them once per capture and use
+        the cached values afterwards.
+        """
+        self._chrome_delta, self._viewport_h = self.execute_script(
+            "return [window.outerHeight - window.innerHeight, "
+            "Math.max(document.documentElement.clientHeight || 0, window.innerHeight || 0)]")
 
     def __get_actual_height(self):
         """
@@ -188,17 +498,19 @@ class BrowserHandler:
         Returns: (int)
             - Returns highest found height of the page
         """
-        max_body_height = int(self.execute_script('return document.body.scrollHeight'))
-        log.info(f"Found max body height {max_body_height}")
-
-        max_document_height = int(
-            self.execute_script('return document.documentElement.scrollHeight'))
-        log.info(f"GAH:: Found max document height: {max_document_height}")
+        return self.__get_page_geometry()['max_height']
 
-        max_height = max([max_body_height, max_document_height])
-        log.info(f"GAH:: Used max height: {max_height}")
+    def __scroll_to_actual_height(self):
+        """
+        Scrolls to the bottom of the page and returns the page height, measuring and scrolling in one round-trip.
 
-        return max_height
+        Returns: (int)
+            - Returns highest found height of the page
+        """
+        return int(self.execute_script(
+            "var height = Math.max(document.body.scrollHeight, document.documentElement.scrollHeight);"
+            "window.scrollTo(0, height);"
+            "return height;"))
 
     def get_max_height(self, df_ht: int = 0, delay: int = 5) -> int:
         """Get Max Height
@@ -220,21 +532,27 @@ class BrowserHandler:
         calculation_times = 5
         calculation_count = 0
 
+        previous_max_height = self.__scroll_to_actual_height()
+        log.info(f'GMH:: prev height found: {previous_max_height}')
+
         while calculation_count < calculation_times:
-            previous_max_height = self.__get_actual_height()
-            log.info(f'GMH:: prev height found: {max_height}')
+            self._wait_until_quiescent(delay)
 
-            self.webdriver.execute_script("window.scrollTo(0, {0})".format(previous_max_height))
-            time.sleep(delay)
+            new_max_height = self.__scroll_to_actual_height()
+            log.info(f'GMH:: new height found: {new_max_height}')
 
-            new_max_height = self.__get_actual_height()
-            log.info(f'GMH:: new height found: {max_height}')
+            # finally assigning max height, the highest of the last two measures is kept since some pages keep
+            # oscillating by a few pixels (sticky footers, lazy placeholders)
+            max_height = max(previous_max_height, new_max_height)
 
-            # break if new max height is equal to previous height
-            if new_max_height == previous_max_height:
-                # finally assigning max height
-                max_height = new_max_height
+            # break if new max height is equal to previous height, or close enough to it not to matter for slices
+            # taken a viewport at a time
+            if abs(new_max_height - previous_max_height) < MAX_HEIGHT_EPSILON:
+                if new_max_height != previous_max_height:
+                    log.info(f'GMH:: Height settled within {MAX_HEIGHT_EPSILON}px '
+                             f'({previous_max_height} -> {new_max_height})')
                 break
+            previous_max_height = new_max_height
             calculation_count += 1
 
         # Only consider df_ht if  vertical dimension from the browser is 0 due to some issue.
@@ -284,35 +602,42 @@ class BrowserHandler:
                 if debug:
                     log.info('GS:: Taking full Screen shot')
 
-                # get max height
-                max_height = self.get_max_height(user_ht, screenshot_delay)
-
                 # Check for screenshot type and call the method corresponding to the method of screenshot capture
                 sc_capture_type = self.kwargs.get('sc_capture_type', 1)
                 crawl_ss_type = self.kwargs.get('crawl_ss_type', sc_capture_type)
-                if crawl_ss_type == sc_capture_type:
-                    if max_height <= cut_merge_threshold:
+
+                # The browser can render the whole page at once, which makes measuring the page height and resizing
+                # the window unnecessary. 'use_native_fullpage' can be turned off to always use the pipeline below.
+                if crawl_ss_type == sc_capture_type and self.kwargs.get('use_native_fullpage', True):
+                    png_ss = self.__get_native_full_page_screenshot(max_width, cut_merge_maximum_length_image,
+                                                                    screenshot_delay, debug)
+
+                if png_ss is None:
+                    self.__load_window_metrics()
+
+                    # get max height
+                    max_height = self.get_max_height(user_ht, screenshot_delay)
+
+                    if crawl_ss_type != sc_capture_type:
+                        if debug:
+                            log.info(f"Using screenshot capture with automation for height {max_height}")
+                        png_ss = self.__get_screenshot_using_automation(cut_merge_maximum_length_image, max_height,
+                                                                        max_width, screenshot_delay,
+                                                                        debug)
+                    elif max_height <= cut_merge_threshold:
                         if debug:
                             log.info(f"GS:: Using Single Screenshot Capture for height {max_height}")
 
                         # adding the window height difference to max height so that we can set up the viewport of
                         # actual page height
-                        window_height = max_height + self.webdriver.execute_script(
-                            "return window.outerHeight - window.innerHeight")
+                        window_height = max_height + self._chrome_delta
 
                         # setting the window height with calculated height
                         self.webdriver.set_window_size(max_width, window_height)
                         if debug:
                             log.info(f"GS:: Telling the driver to set window size to {max_width}x{window_height}")
 
-                        # Some web pages are not being loaded without the initial scroll, so we are scrolling to the
-                        # bottom of the page and scrolling back to the top to take the screenshot.
-                        # Reference : https://smarsh.atlassian.net/browse/WA-4020
-                        self.webdriver.execute_script("window.scrollTo({0}, {1})".format(max_width, max_height))
-                        time.sleep(screenshot_delay)
-
-                        self.webdriver.execute_script("window.scrollTo(0, 0)")
-                        time.sleep(screenshot_delay)
+                        self.__trigger_lazy_loading(max_width, screenshot_delay)
 
                         # Takes screenshot
                         png_ss = self.webdriver.get_screenshot_as_png()
@@ -322,20 +647,13 @@ class BrowserHandler:
                                      f"exceeds the threshold {cut_merge_threshold}")
                         png_ss = self.__get_screenshot_using_cut_and_merger(max_width, screenshot_delay, debug)
 
-                else:
-                    if debug:
-                        log.info(f"Using screenshot capture with automation for height {max_height}")
-                    png_ss = self.__get_screenshot_using_automation(cut_merge_maximum_length_image, max_height,
-                                                                    max_width, screenshot_delay,
-                                                                    debug)
-
             else:
                 if debug:
                     log.info('GS:: Taking customized height screen shot as given by the user')
                 # respect the height given by the user
                 max_height = user_ht
                 self.webdriver.set_window_size(max_width, max_height)
-                time.sleep(screenshot_delay)
+                self._wait_until_quiescent(screenshot_delay)
                 png_ss = self.webdriver.get_screenshot_as_png()
 
         except Exception as e:
@@ -349,6 +667,125 @@ class BrowserHandler:
 
         return png_ss
 
+    def __trigger_lazy_loading(self, scroll_x, screenshot_delay):
+        """
+            Some web pages are not being loaded without the initial scroll, so we are scrolling to the bottom of the
+            page and scrolling back to the top before taking the screenshot.
+            Reference : https://smarsh.atlassian.net/browse/WA-4020
+
+            A frame is rendered at the bottom before scrolling back, which is enough to trigger the lazy loading,
+            then a single wait lets the page settle.
+
+                :param scroll_x : (int)
+                       - horizontal position to scroll to along with the bottom of the page
+                :param screenshot_delay : (int)
+                        - maximum number of seconds to wait for the page to settle
+        """
+        # Hidden or throttled windows don't render frames, the timer scrolls back and finishes the script when
+        # the frames don't come
+        self.execute_async_script("""
+            var callback = arguments[arguments.length - 1], finished = false;
+            var done = function () {
+                if (!finished) {
+                    finished = true;
+                    window.scrollTo(0, 0);
+                    callback();
+                }
+            };
+            window.scrollTo(arguments[0], Math.max(document.body.scrollHeight, document.documentElement.scrollHeight));
+            requestAnimationFrame(function () {
+                requestAnimationFrame(function () {
+                    window.scrollTo(0, 0);
+                    requestAnimationFrame(done);
+                });
+            });
+            setTimeout(done, 200);
+            """, scroll_x)
+        self._wait_until_quiescent(screenshot_delay)
+
+    def __get_native_full_page_screenshot(self, max_width, maximum_length_image, screenshot_delay, debug=False):
+        """
+            Takes the full page screenshot with the browser's own full page capture, see _full_page_screenshot_cdp().
+            Pages taller than the browser can render in one capture are left to the scroll based methods.
+
+                :param max_width : (int)
+                       - width specified by user for the screenshot.
+                :param maximum_length_image : (int)
+                       - pages taller than this are not captured natively either
+                :param screenshot_delay : (int)
+                        - maximum number of seconds to wait for the page to settle
+                :param debug : (bool)
+                       - set to true for debug output
+                :return:
+                    - png data, None when the browser doesn't support full page capture
+        """
+        # Selenium 3 clients have neither of the full page capture methods, don't wait for the page in vain
+        capture_methods = ('execute_cdp_cmd', 'get_full_page_screenshot_as_png')
+        if not any(hasattr(self.webdriver, method) for method in capture_methods):
+            return None
+
+        try:
+            # a single cheap read instead of the get_max_height loop, the browsers can't render canvases taller than
+            # NATIVE_CAPTURE_MAX_HEIGHT device pixels
+            page_height, dpr = self.execute_script(
+                "return [Math.max(document.body.scrollHeight, document.documentElement.scrollHeight), "
+                "window.devicePixelRatio || 1]")
+            page_height = int(page_height)
+            if page_height > maximum_length_image or page_height * dpr > NATIVE_CAPTURE_MAX_HEIGHT:
+                if debug:
+                    log.info(f"GS:: Page height {page_height} is too tall for full page capture, falling back")
+                return None
+
+            # drivers only resize when both dimensions are given, keep the current height
+            self.webdriver.set_window_size(max_width, self.webdriver.get_window_size()['height'])
+            self.__trigger_lazy_loading(0, screenshot_delay)
+            png_ss = self._full_page_screenshot_cdp()
+        except Exception as e:
+            log.info(f"GS:: Full page capture is not available, falling back. Error: {e}")
+            return None
+
+        # the page may have grown while lazy loading, a capture reaching the canvas limit has been cut off
+        if ScreenshotHelper.png_height(png_ss) >= NATIVE_CAPTURE_MAX_HEIGHT:
+            log.info("GS:: Full page capture reached the canvas limit, falling back")
+            return None
+
+        if debug:
+            log.info("GS:: Using Full Page Capture")
+        return png_ss
+
+    def _full_page_screenshot_cdp(self):
+        """
+            Captures the whole page in a single request instead of scrolling and stitching viewport screenshots.
+            Chrome uses the devtools Page.captureScreenshot command with captureBeyondViewport, Firefox uses the
+            full page screenshot endpoint of geckodriver.
+
+                :return:
+                    - png data, which should come back as binary
+                :raises:
+                    - Exception when the browser or the selenium version does not support full page capture
+        """
+        if 'chrome' in self.browser_type:
+            # without a clip only the viewport is captured, clip to the whole content like puppeteer does
+            metrics = self.webdriver.execute_cdp_cmd("Page.getLayoutMetrics", {})
+            content_size = metrics.get('cssContentSize') or metrics['contentSize']
+            result = self.webdriver.execute_cdp_cmd("Page.captureScreenshot", {
+                "captureBeyondViewport": True,
+                "fromSurface": True,
+                "format": "png",
+                "clip": {
+                    "x": 0,
+                    "y": 0,
+                    "width": math.ceil(content_size['width']),
+                    "height": math.ceil(content_size['height']),
+                    "scale": 1,
+                },
+            })
+            return base64.b64decode(result['data'])
+        if 'firefox' in self.browser_type:
+            return self.webdriver.get_full_page_screenshot_as_png()
+
+        raise TypeError(f"Full page capture is not supported for {self.browser_type}")
+
     def __get_screenshot_using_cut_and_merger(self, max_width, screenshot_delay, debug=False):
         """
             This function scrolls the page  and takes screenshots at every instance of the  scroll and merges all the
@@ -364,12 +801,11 @@ class BrowserHandler:
                 :return:
                     - png data, which should come back as binary           """
 
-        slices = []
-        offset = 0
+        # slices are kept png encoded, which is a fraction of their decoded size, until they are merged
+        png_slices = []
         scroll_x = 0
         # defining the default window height to 15000 so that the screenshot shot chunk can be exact
         window_height = 15000
-        ss_count = 0
 
         # get total page height
         max_height = self.get_max_height()
@@ -383,8 +819,7 @@ class BrowserHandler:
 
         # adding the window height difference to max height so that we can set up the viewport of
         # actual page height
-        new_window_height = window_height + self.webdriver.execute_script(
-            "return window.outerHeight - window.innerHeight")
+        new_window_height = window_height + self._chrome_delta
         if debug:
             log.info(f"CM:: Found new window height {new_window_height}")
 
@@ -392,39 +827,66 @@ class BrowserHandler:
         if debug:
             log.info(f"CM:: Telling the driver to set the window size to {max_width}x{new_window_height}")
 
-        while ss_count < max_ss_count:
+        # every slice covers exactly one viewport, so the scroll positions follow from the slice height
+        slice_height = window_height
+        for ss_count in range(max_ss_count):
             if debug:
                 log.info(f"CM:: Screenshot count {ss_count}")
 
-                # Setting the window to the appropriate offset
-            self.webdriver.execute_script("window.scrollTo({0}, {1})".format(scroll_x, offset))
+            # Setting the window to the appropriate offset
+            scroll_y = ss_count * slice_height
+            self.execute_script("window.scrollTo(arguments[0], arguments[1])", scroll_x, scroll_y)
             if debug:
-                log.info(f"CM:: Scrolling to {scroll_x}x{offset}")
+                log.info(f"CM:: Scrolling to {scroll_x}x{scroll_y}")
 
             # waiting for a while after scrolling to the position
-            time.sleep(screenshot_delay)
+            self._wait_until_quiescent(screenshot_delay)
 
-            img = Image.open(io.BytesIO(self.webdriver.get_screenshot_as_png()))
+            png_bytes = self.webdriver.get_screenshot_as_png()
+            png_slices.append(png_bytes)
 
-            # always get the offset from the image height to get the next position for accuracy
-            offset += img.size[1]
+            # validate the slice height once, the browser may not have been able to fit the requested viewport
+            if ss_count == 0 and ScreenshotHelper.png_height(png_bytes) != slice_height:
+                slice_height = ScreenshotHelper.png_height(png_bytes)
+                log.info(f"CM:: Using the captured slice height {slice_height} instead of {window_height}")
 
-            if debug:
-                log.info(f"CM:: New offset position {offset}")
-
-            slices.append(img)
-            ss_count += 1
+        offset = max_ss_count * slice_height
+        if debug:
+            log.info(f"CM:: Last offset position {offset}")
 
         # check and capture last screenshot if available
-        last_image = self.capture_remaining_section(slices, max_height, max_width, window_height, scroll_x,
-                                                    screenshot_delay, debug)
+        last_image = self.__capture_remaining_section(offset, max_height, max_width, window_height, scroll_x,
+                                                      screenshot_delay, debug)
+
+        # the slices are decoded while the merged screenshot is being filled and released once copied into it
+        total_image_height = sum(ScreenshotHelper.png_height(png_bytes) for png_bytes in png_slices)
+        slices = self.__decode_slices(png_slices)
         if last_image:
-            slices.append(last_image)
+            total_image_height += last_image.size[1]
+            slices = itertools.chain(slices, [last_image])
 
         width = [int(max_width)]
-        png_ss = ScreenshotHelper.get_combined_screenshot(slices, width, offset)
+        png_ss = ScreenshotHelper.get_combined_screenshot(slices, width, total_image_height)
         return png_ss
 
+    def __decode_slices(self, png_slices):
+        """
+            Decodes the png slices on the decode pool and yields them in order. Only a couple of slices are decoded
+            ahead of the consumer, so the decoded slices are never all held in memory at once.
+
+                :param png_slices : (list)
+                       - png data of the screenshot slices
+                :return:
+                    - generator of decoded PIL Images
+        """
+        pending = deque()
+        for png_bytes in png_slices:
+            pending.append(self._decode_pool.submit(_decode_png, png_bytes))
+            if len(pending) > 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
     def __get_screenshot_using_automation(self, maximum_length_image, max_height,
                                           max_width, screenshot_delay, debug=False):
         """
@@ -457,19 +919,26 @@ class BrowserHandler:
 
         # Take the window height to add to the offset
         # Ref: https://stackoverflow.com/questions/1248081/how-to-get-the-browser-viewport-dimensions
-        view_port_height = self.webdriver.execute_script(
-            "return Math.max(document.documentElement.clientHeight || 0, window.innerHeight || 0);")
+        view_port_height = self._viewport_h
+
+        # The window height doesn't change while scrolling, it is the viewport plus the browser chrome
+        win_height = view_port_height + self._chrome_delta
+        # always need to set the max_width to customize dimension else image will be cut off
+        self.webdriver.set_window_rect(x=0, y=0, width=max_width, height=win_height)
+        if debug:
+            log.info(f"CM:: Set New Window Size {max_width}x{win_height}")
 
         while offset < max_height:
 
             # Setting the window to the appropriate offset
             if debug:
                 log.info(f"CM:: Scrolling to {scroll_x}x{offset}")
-            self.webdriver.execute_script("window.scrollTo({0}, {1})".format(scroll_x, offset))
-            time.sleep(screenshot_delay)
+            self.execute_script("window.scrollTo(arguments[0], arguments[1])", scroll_x, offset)
+            self._wait_until_quiescent(screenshot_delay)
 
-            # Get current location
-            page_y_offset = self.webdriver.execute_script("return window.pageYOffset;")
+            # Get current location and scroll height in one round-trip
+            geometry = self.__get_page_geometry()
+            page_y_offset = geometry['page_y_offset']
             if debug:
                 log.info(f"CM:: PageYOffset {page_y_offset}")
 
@@ -482,8 +951,8 @@ class BrowserHandler:
                 log.info("CM:: PageYOffset has moved, allowing to continue")
                 orig_page_y_offset = page_y_offset
 
-            # Calculate new scroll height and compare with last scroll height
-            new_height = self.__get_actual_height()
+            # Compare the new scroll height with last scroll height
+            new_height = geometry['max_height']
             if debug:
                 log.info(f"CM:: New ScrollHeight Found {new_height}")
 
@@ -493,12 +962,8 @@ class BrowserHandler:
                 if debug:
                     log.info(f"CM:: Using New ScrollHeight {max_height}")
 
-            # Get the new window height so that we can set the window size
-            win_height = self.webdriver.get_window_size().get('height')
-            # always need to set the max_width to customize dimension else image will be cut off
-            self.webdriver.set_window_size(max_width, win_height)
-            if debug:
-                log.info(f"CM:: Set New Window Size {max_width}x{win_height}")
+                # the layout changed, make sure the window still has the requested width
+                self.webdriver.set_window_rect(width=max_width, height=win_height)
 
             offset += view_port_height
             log.info(f"CM:: New Height Offset is {offset}")
@@ -523,70 +988,59 @@ class BrowserHandler:
                 screenshot_delay (int): Time of screenshot delay
         """
         # Adding time.sleep so that it gets time to execute the commands
-        retry = 1
-        success = False
         time.sleep(1)
         self.get_screenshot_xdotool()
-        time.sleep(screenshot_delay)
+        # The screenshot frames show up asynchronously, poll for them for as long as we used to sleep and retry
+        wait = WebDriverWait(self.webdriver, screenshot_delay + 6, poll_frequency=0.1)
         # Simulating the button click for downloading the screenshot directly from the browser
         # This iframe is what is being displayed after key press of Ctrl+Shift+s
-        while retry < 6:
-            try:
-                self.webdriver.switch_to.frame("firefox-screenshots-preselection-iframe")
-                success = True
-                break
-            except:
-                log.info(f'Retrying to switch the iframe # {retry} times')
-                retry += 1
-                log.info(f'Sleep 1 second before retry')
-                time.sleep(1)
-                continue
+        try:
+            wait.until(EC.frame_to_be_available_and_switch_to_it("firefox-screenshots-preselection-iframe"))
+        except TimeoutException:
+            log.error("Couldn't switch to the screenshot preselection iframe")
+            return False
         # There is a button called 'Save full page' which is what we click
-        self.webdriver.find_element_by_class_name("full-page").click()
+        wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "full-page"))).click()
         # Need to switch back to default content from previous iframe
         self.webdriver.switch_to.default_content()
-        time.sleep(screenshot_delay)
         # A window pops up which we want to select as the current iframe
-        self.webdriver.switch_to.frame("firefox-screenshots-preview-iframe")
-        time.sleep(1)
+        wait.until(EC.frame_to_be_available_and_switch_to_it("firefox-screenshots-preview-iframe"))
         # In the window opened, we need to click the download button
-        self.webdriver.find_element_by_class_name("highlight-button-download").click()
+        wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "highlight-button-download"))).click()
         time.sleep(1)
         # Switch back to default content
         self.webdriver.switch_to.default_content()
         time.sleep(1)
 
-        if success:
-            return True
+        return True
 
     def get_screenshot_xdotool(self):
         """
-            To zoom out if necessary and press keys as mentioned
+            To zoom out if necessary and press keys as mentioned.
+            All the key presses are chained in a single xdotool invocation.
         """
+        try:
+            zoom_out_value = self.kwargs.get('browser_ss_preference', {}).get('BrowserAutomation', {}).get(
+                'zoom_out', None)
+        except Exception as e:
+            zoom_out_value = None
+            log.error(f"Couldn't get the zoom out value. Error {e}")
+
+        zoom_out_count = 0
+        if zoom_out_value and zoom_out_value[0] is not None:
+            zoom_out_count = int(zoom_out_value[0])
 
-        # Define the xdotool command
-        screenshot_command = "xdotool key --delay 100 ctrl+shift+s"
-        zoom_out_command = "xdotool key --delay 100 ctrl+minus"
+        # Zoom out as configured, give the page 3 seconds to settle and press Ctrl+Shift+s to take a screenshot
+        xdotool_command = ["xdotool"]
+        if zoom_out_count:
+            xdotool_command += ["key", "--delay", "100"] + ["ctrl+minus"] * zoom_out_count
+        xdotool_command += ["sleep", "3", "key", "--delay", "100", "ctrl+shift+s"]
 
         # Run the xdotool command in a subprocess
         try:
-            # Simulate zooming out two times
-            try:
-                zoom_out_value = self.kwargs.get('browser_ss_preference', {}).get('BrowserAutomation', {}).get(
-                    'zoom_out', None)
-            except Exception as e:
-                zoom_out_value = None
-                log.error(f"Couldn't get the zoom out value. Error {e}")
-
-            if zoom_out_value and zoom_out_value[0] is not None:
-                for _ in range(int(zoom_out_value[0])):
-                    subprocess.run(zoom_out_command, shell=True, check=True)
-                    log.info("Zoomed out.")
-            time.sleep(3)
-            # Run the xdotool command to take a screenshot
-            subprocess.run(screenshot_command, shell=True, check=True)
-            log.info("Pressed the Ctrl+Shift+s Key")
-        except subprocess.CalledProcessError as e:
+            subprocess.run(xdotool_command, check=True, timeout=30)
+            log.info(f"Zoomed out {zoom_out_count} times and pressed the Ctrl+Shift+s Key")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
             log.error(f"Error while running subprocess command. Error: {e}")
 
     def get_screenshot_by_automation(self, screenshot_delay=10):
@@ -598,26 +1052,10 @@ class BrowserHandler:
             screenshot_delay (int): Number of seconds of screenshot delay
         """
         image_dir_path = self.kwargs.get('tmp_ss_dir')
-        time.sleep(screenshot_delay)
-        retry = 1
-        # WA-8092: Retry upto 5 times before throwing an error for getting screenshot
-        while retry < 6:
-            files = os.listdir(image_dir_path)
-            # Check if there is exactly one file in the folder
-            if len(files) == 1:
-                # Get the file name
-                file_name = files[0]
-
-                # Construct the full path to the file
-                image_path = os.path.join(image_dir_path, file_name)
-                log.info(f'Constructed image path {image_path}')
-                break
-            else:
-                log.info(f'Retrying getting the screenshot # {retry} times')
-                retry += 1
-                log.info(f'Sleep 1 second before retry')
-                time.sleep(1)
-                continue
+        # WA-8092: Wait up to 5 more seconds than the screenshot delay before throwing an error for getting screenshot
+        image_path = self.__wait_for_screenshot_file(image_dir_path, screenshot_delay + 5)
+        if image_path:
+            log.info(f'Constructed image path {image_path}')
 
         try:
             # Read the image from the mentioned path and return the image bytes
@@ -635,6 +1073,50 @@ class BrowserHandler:
             except Exception as e:
                 log.error(f"Error while removing the directory: {e}")
 
+    @staticmethod
+    def __find_screenshot_file(image_dir_path):
+        """
+            Returns the path of the screenshot file if there is exactly one finished file in the folder, else None.
+            Firefox writes downloads to a '.part' file first, those are not finished yet.
+        """
+        files = [file_name for file_name in os.listdir(image_dir_path) if not file_name.endswith('.part')]
+        if len(files) == 1:
+            return os.path.join(image_dir_path, files[0])
+        return None
+
+    def __wait_for_screenshot_file(self, image_dir_path, timeout):
+        """
+            Waits for the browser to write the screenshot file to the given folder. On Linux we block on inotify
+            events and wake up as soon as the file is written, elsewhere we poll the folder.
+
+            Args:
+                image_dir_path (str): Folder the browser downloads the screenshot to
+                timeout (int): Maximum number of seconds to wait
+            Returns:
+                image_path (str): Path of the screenshot file, None if it didn't show up in time
+        """
+        deadline = time.monotonic() + timeout
+
+        if INotify is None:
+            image_path = self.__find_screenshot_file(image_dir_path)
+            while image_path is None and time.monotonic() < deadline:
+                time.sleep(0.1)
+                image_path = self.__find_screenshot_file(image_dir_path)
+            return image_path
+
+        with INotify() as inotify:
+            inotify.add_watch(image_dir_path, flags.CLOSE_WRITE | flags.MOVED_TO)
+            # The file could have been written before the watch was added
+            image_path = self.__find_screenshot_file(image_dir_path)
+            while image_path is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                events = inotify.read(timeout=int(remaining * 1000))
+                if any(not event.name.endswith('.part') for event in events):
+                    image_path = self.__find_screenshot_file(image_dir_path)
+            return image_path
+
     def get_url(self, url=None):
         """
         Uses webdriver object to navigate to given URL in browser
@@ -652,6 +1134,8 @@ class BrowserHandler:
         if self.webdriver is None:
             raise TypeError('No webdriver found.')
 
+        self._current_host = urlparse(url).netloc
+
         try:
             result = self.webdriver.get(url)
         except Exception as e:
@@ -666,10 +1150,19 @@ class BrowserHandler:
         in a 'Running' state and must be terminated by Webdriver.quit(). Browser's profile is also
         removed from disk unless the 'clean' flag is set to False
 
+        Handlers created with acquire() don't close the browser, the session is reset and handed back to its
+        pool, which owns the profile directory.
+
         :param clean:
             - Default is True, which will remove the profile directory. False will leave the artifacts
             behind. False should be set for debugging/testing only
         """
+        if self.browser_pool:
+            if self.webdriver is not None:
+                self.browser_pool.release(self.webdriver, self.browser_profile_loc)
+                self.webdriver = None
+            return
+
         try:
             self.webdriver.close()
         except Exception as e:
@@ -679,78 +1172,67 @@ class BrowserHandler:
 
     def quit(self):
         """
-        Uses Webdriver's own 'quit()' method to terminate the driver's process
+        Uses Webdriver's own 'quit()' method to terminate the driver's process.
+        Handlers created with acquire() hand the browser session back to the pool instead.
         """
-        try:
-            self.webdriver.quit()
-        except Exception as e:
-            log.error(e)
+        if self.browser_pool:
+            self.close()
+        else:
+            try:
+                self.webdriver.quit()
+            except Exception as e:
+                log.error(e)
+        self._decode_pool.shutdown(wait=False)
 
     def _browser_cleanup(self):
         """
-        This will remove the browser profile artifacts from disk
+        This will remove the browser profile artifacts from disk. The removal runs in the background, a profile
+        directory that no longer exists is ignored.
         """
         if not self.browser_profile_loc:
             raise TypeError("No browser_profile location was specified, cannot remove what we don't know.")
 
-        if os.path.exists(self.browser_profile_loc):
-            try:
-                shutil.rmtree(self.browser_profile_loc)
-            except Exception as e:
-                log.error(e)
-        else:
-            raise TypeError("The profile directory specified no longer exists, nothing to remove")
-
-    def get_page_links(self):
-        """
-        Gets 'a href' links via browser's javascript console
-
-        Returns:
-            list(str): list of discovered links
+        _cleanup_pool.submit(shutil.rmtree, self.browser_profile_loc, ignore_errors=True)
 
-        """
-        js_script = """
-            allHrefs = []
-            links = document.links;
-            cssFile = document.styleSheets;
-            favicon = undefined;
-            faviconShort = document.querySelectorAll("[rel='shortcut icon']");
-            faviconLong = document.querySelectorAll("[rel='icon']");
-            if (faviconShort.length){
-                favicon = faviconShort[0].href;
+    # Shared by get_page_links, get_page_src_urls and get_page_urls, dedupes through a Set to stay linear on
+    # pages with thousands of links
+    _PAGE_LINKS_JS = """
+            const seenLinks = new Set();
+            const favicon = document.querySelector('link[rel~="icon"]');
+            if (favicon && favicon.href){
+                seenLinks.add(favicon.href);
             }
-            if (faviconLong.length){
-                favicon = faviconLong[0].href;
-            }
-            if (favicon && allHrefs.includes(favicon) === false){
-                allHrefs.push(favicon);
+            for (const item of document.styleSheets){
+                if (item.href){
+                    seenLinks.add(item.href);
+                }
             }
-            for (let item of cssFile){
-                url = item.href
-                if (url && allHrefs.includes(url) === false){
-                    allHrefs.push(url);
+            for (const item of document.links){
+                if (item.href){
+                    seenLinks.add(item.href);
                 }
             }
-            for (let item of links) {
-                url = item.href
-                if (url && allHrefs.includes(url) === false){
-                    allHrefs.push(url);
+            """
+    _PAGE_SRC_JS = """
+            const seenSrc = new Set();
+            for (const item of document.querySelectorAll('[src]')){
+                const url = item.getAttribute('src');
+                if (url){
+                    seenSrc.add(encodeURI(url));
                 }
             }
-            return allHrefs;
             """
-        links = []
-        retry = 3
-        while retry > 0:
-            try:
-                links = self.execute_script(js_script)
-            except Exception as e:
-                log.error(f'{e}. Retrying to get links')
-                retry -= 1
-            else:
-                break
 
-        return links
+    def get_page_links(self):
+        """
+        Gets 'a href' links via browser's javascript console
+
+        Returns:
+            list(str): list of discovered links
+
+        """
+        js_script = self._PAGE_LINKS_JS + "return [...seenLinks];"
+        return _retry_with_backoff(lambda: self.execute_script(js_script), default=[], description='getting links')
 
     def get_page_source(self):
         """
@@ -761,20 +1243,7 @@ class BrowserHandler:
             str: Page source
 
         """
-        retry = 3
-        page_source = None
-
-        while retry > 0:
-            try:
-                page_source = self.webdriver.page_source
-            except Exception as e:
-                log.error(f'{e}. Retrying to get page source')
-                retry -= 1
-                time.sleep(0.5)
-            else:
-                break
-
-        return page_source
+        return _retry_with_backoff(lambda: self.webdriver.page_source, description='getting page source')
 
     def get_page_src_urls(self):
         """
@@ -782,28 +1251,21 @@ class BrowserHandler:
         Returns:
             list(str): list of discovered links
         """
-        js_script = """
-            srcUrls = []
-            src_objs = document.querySelectorAll('[src]');
-            for (let item of src_objs) {
-                url = item.getAttribute('src')
-                if (url && srcUrls.includes(url) === false){
-                    srcUrls.push(encodeURI(url));
-                }
-            }
-            return srcUrls;
-            """
-        src_urls = []
-        retry = 3
-        while retry > 0:
-            try:
-                src_urls = self.execute_script(js_script)
-            except Exception as e:
-                log.error(f'{e}. Retrying to get links')
-                retry -= 1
-            else:
-                break
-        return src_urls
+        js_script = self._PAGE_SRC_JS + "return [...seenSrc];"
+        return _retry_with_backoff(lambda: self.execute_script(js_script), default=[],
+                                   description='getting src urls')
+
+    def get_page_urls(self):
+        """
+        Gets both the 'a href' links and the 'src' urls with a single call to the browser, saves a webdriver round
+        trip over calling get_page_links and get_page_src_urls one after the other
+
+        Returns:
+            dict: {'links': list(str), 'src': list(str)}
+        """
+        js_script = self._PAGE_LINKS_JS + self._PAGE_SRC_JS + "return {links: [...seenLinks], src: [...seenSrc]};"
+        urls = _retry_with_backoff(lambda: self.execute_script(js_script), default={}, description='getting urls')
+        return {'links': urls.get('links') or [], 'src': urls.get('src') or []}
 
     def _load_har_export_plugin(self, wd, **kwargs):
         """
@@ -849,7 +1311,36 @@ class BrowserHandler:
             This function scrolls the page to the last possible offset value and takes screenshots of the remaining
             page height
                 :param ss_chunks : (list)
-                        - Is maximum length where scroll and cut loop breaks.
+                        - Screenshot slices captured so far, PIL images or png data, the remaining section starts
+                          below them.
+                :param total_height : (int)
+                       - document.body.scrollHeight .
+                :param win_width : (int)
+                       - width specified by user for the screens hot.
+                :param win_height : (int)
+                        - delay used between scroll calls to allow for refreshing of the page
+                :param scroll_x : (bool)
+                       - set to true for debug output
+                :param screenshot_delay : (int)
+                        - delay used between scroll calls to allow for refreshing of the page
+                :param debug : (bool)
+                       - set to true for debug output
+                :return:
+                    - png data, which should come back as binary
+        """
+        first_slice = ss_chunks[0]
+        slice_height = (ScreenshotHelper.png_height(first_slice) if isinstance(first_slice, bytes)
+                        else first_slice.height)
+        return self.__capture_remaining_section(slice_height * len(ss_chunks), total_height, win_width, win_height,
+                                                scroll_x, screenshot_delay, debug)
+
+    def __capture_remaining_section(self, scroll_offset, total_height, win_width, win_height, scroll_x,
+                                    screenshot_delay, debug=False):
+        """
+            This function scrolls the page to the last possible offset value and takes screenshots of the remaining
+            page height
+                :param scroll_offset : (int)
+                        - Offset position of the remaining section, the height of the slices captured so far.
                 :param total_height : (int)
                        - document.body.scrollHeight .
                 :param win_width : (int)
@@ -878,20 +1369,22 @@ class BrowserHandler:
             if debug:
                 log.info(f"CRS:: Taking final screen shot")
 
-            # modifying the height to ensure that the max page height to get accurate scroll position.
-            self.webdriver.execute_script(
-                "return document.body.style.height = {0}+'px'".format(total_height + win_height))
+            # In a single script: modifying the height to ensure that the max page height to get accurate scroll
+            # position, scrolling page to the bottom offset to the remaining section and reading the browser chrome
+            # height. The document is made taller than the page so the scroll position survives the resize below.
+            chrome_delta = self.execute_script("""
+                document.body.style.height = arguments[0] + 'px';
+                window.scrollTo(arguments[1], arguments[2]);
+                return window.outerHeight - window.innerHeight;
+                """, total_height + win_height, scroll_x, scroll_offset)
+            if self._chrome_delta is None:
+                self._chrome_delta = chrome_delta
             if debug:
                 log.info(f"CRS:: New document height {total_height + win_height}")
-
-            # calculate latest offset position of remaining section
-            scroll_offset = ss_chunks[0].height * len(ss_chunks)
-            if debug:
-                log.info(f"CRP:: Last offset position {scroll_offset}")
+                log.info(f"Scrolling page to {scroll_x}x{scroll_offset}")
 
             # new height to resize window to get last remaining height of page with more accuracy
-            new_win_height = remaining_page_height + self.webdriver.execute_script(
-                "return window.outerHeight - window.innerHeight")
+            new_win_height = remaining_page_height + self._chrome_delta
             # resizing the window size for remaining section
 
             # adding extra height of 3500px in window to include all content, some time the viewport doesn't show all
@@ -899,13 +1392,7 @@ class BrowserHandler:
             self.webdriver.set_window_size(win_width, new_win_height + 3500)
             if debug:
                 log.info(f"Telling driver to set window size: {win_width} X {new_win_height}")
-            time.sleep(screenshot_delay)
-
-            # scrolling page to the bottom offset to the remaining section
-            self.webdriver.execute_script("window.scrollTo({0}, {1})".format(scroll_x, scroll_offset))
-            if debug:
-                log.info(f"Scrolling page to {scroll_x}x{scroll_offset}")
-            time.sleep(screenshot_delay)
+            self._wait_until_quiescent(screenshot_delay)
 
             image = Image.open(io.BytesIO(self.webdriver.get_screenshot_as_png()))
 
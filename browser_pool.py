@@ -0,0 +1,241 @@
+import queue
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .browser_handler import BrowserHandler
+from wa.core.logging.logger import StandardOutLoggingHandler
+
+log = StandardOutLoggingHandler("wa.browser_pool").get_logger()
+
+
+class BrowserPool:
+    """
+        Keeps a number of warm browser sessions around so that crawls don't pay the browser cold start, profile
+        creation and plugin installation for every page. Sessions are handed out with acquire() and given back
+        with release(), which resets them to a blank page without cookies.
+
+        Sessions that have been idle for longer than `timeout_seconds` are considered stale and are replaced by a
+        fresh session the next time they are acquired. A session that couldn't be started is retried by the next
+        acquire() so the pool keeps its size.
+
+        :param size
+            - Number of browser sessions kept by the pool, all of them are started eagerly.
+
+        :param profile_factory
+            - Callable without arguments returning a `(webdriver, profile_dir)` tuple for a new browser session, e.g.
+
+                def profile_factory():
+                    handler = BrowserHandler(executable_path=gecko_path)
+                    handler.create_webdriver()
+                    return handler.webdriver, handler.browser_profile_loc
+
+        :param timeout_seconds
+            - Maximum number of seconds a session may stay idle in the pool before it is recycled.
+    """
+
+    def __init__(self, size, profile_factory, timeout_seconds=600):
+        if size < 1:
+            raise TypeError("Browser pool size should be at least 1.")
+
+        self.size = size
+        self.profile_factory = profile_factory
+        self.timeout_seconds = timeout_seconds
+        self._sessions = queue.Queue()
+
+        # Browser start up is slow and mostly waiting, so start all the sessions at once. The sessions are kept
+        # as (webdriver, profile_dir, idle_since) tuples, None marks a lost session to be started on acquire().
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            for session in executor.map(lambda _: self._try_spawn(), range(size)):
+                self._sessions.put(session)
+
+    def _spawn(self):
+        """
+        Starts a new browser session.
+
+        :return:
+            - (webdriver, profile_dir, idle_since) tuple
+        """
+        webdriver, profile_dir = self.profile_factory()
+        return webdriver, profile_dir, time.monotonic()
+
+    def _try_spawn(self):
+        """
+        Starts a new browser session, logs the failure instead of raising it.
+
+        :return:
+            - (webdriver, profile_dir, idle_since) tuple, None when the browser couldn't be started
+        """
+        try:
+            return self._spawn()
+        except Exception as e:
+            log.error(f"Couldn't start a browser session, it will be retried on the next acquire. Error: {e}")
+            return None
+
+    @staticmethod
+    def _discard(webdriver, profile_dir):
+        """
+        Terminates the browser session and removes its profile from disk.
+        """
+        try:
+            webdriver.quit()
+        except Exception as e:
+            log.error(e)
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    def acquire(self, timeout=None):
+        """
+        Takes a browser session out of the pool, blocks until one is available.
+
+        :param timeout:
+            - Number of seconds to wait for a free session, waits forever when None
+
+        :return:
+            - (webdriver, profile_dir) tuple
+        """
+        session = self._sessions.get(timeout=timeout)
+
+        if session is not None and time.monotonic() - session[2] > self.timeout_seconds:
+            log.info(f"Recycling browser session idle for more than {self.timeout_seconds} seconds")
+            self._discard(session[0], session[1])
+            session = None
+
+        if session is None:
+            try:
+                session = self._spawn()
+            except Exception:
+                # keep the slot so that the pool doesn't shrink, the next acquire() tries again
+                self._sessions.put(None)
+                raise
+
+        webdriver, profile_dir, _ = session
+        return webdriver, profile_dir
+
+    def release(self, webdriver, profile_dir):
+        """
+        Resets the browser session and puts it back in the pool. A session that can't be reset is replaced by a
+        new one so the pool keeps its size.
+
+        :param webdriver:
+            - Webdriver object returned by acquire()
+        :param profile_dir:
+            - Profile directory returned by acquire()
+        """
+        try:
+            webdriver.delete_all_cookies()
+            webdriver.get("about:blank")
+            session = (webdriver, profile_dir, time.monotonic())
+        except Exception as e:
+            log.error(f"Couldn't reset the browser session, replacing it. Error: {e}")
+            self._discard(webdriver, profile_dir)
+            session = self._try_spawn()
+
+        self._sessions.put(session)
+
+    def close(self):
+        """
+        Terminates all the idle browser sessions of the pool and removes their profiles from disk.
+        """
+        while True:
+            try:
+                session = self._sessions.get_nowait()
+            except queue.Empty:
+                break
+            if session is not None:
+                self._discard(session[0], session[1])
+
+
+class BrowserHandlerPool:
+    """
+        Owns a number of ready to use BrowserHandler objects so that independent page captures can run in parallel,
+        each on its own browser. A handler is used by a single thread at a time, the pool hands it out with
+        acquire() and takes it back when the `with` block ends.
+
+            def capture(bh, url):
+                bh.get_url(url)
+                return bh.get_screenshot(full=True)
+
+            pool = BrowserHandlerPool(4, executable_path=gecko_path)
+            screenshots = pool.map(capture, urls)
+            pool.close()
+
+        The BrowserHandler API itself is unchanged, a pool of size 1 behaves like a single handler.
+
+        :param size
+            - Number of browser handlers, all of them are created eagerly, each in its own thread.
+
+        :param seconds
+            - Page load timeout of the handlers, see BrowserHandler.set_page_timeout()
+
+        :param handler_kwargs
+            - Passed on to every BrowserHandler
+    """
+
+    def __init__(self, size, seconds=60, **handler_kwargs):
+        if size < 1:
+            raise TypeError("Browser handler pool size should be at least 1.")
+
+        self.size = size
+        self.seconds = seconds
+        self.handler_kwargs = handler_kwargs
+        # The browser sessions, their reset and their recovery are handled by a BrowserPool, handlers are created
+        # around the borrowed sessions with BrowserHandler.acquire()
+        self._pool = BrowserPool(size, self._create_session)
+
+    def _create_session(self):
+        """
+        Starts a browser with its own profile, used as the profile factory of the BrowserPool.
+
+        :return:
+            - (webdriver, profile_dir) tuple
+        """
+        handler = BrowserHandler(**self.handler_kwargs)
+        try:
+            handler.create_webdriver(self.seconds)
+        except Exception:
+            if handler.browser_profile_loc:
+                handler._browser_cleanup()
+            raise
+        return handler.webdriver, handler.browser_profile_loc
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """
+        Borrows a browser handler for the duration of the `with` block, blocks until one is available. The browser
+        is reset to a blank page without cookies when the handler is given back.
+
+        :param timeout:
+            - Number of seconds to wait for a free handler, waits forever when None
+        """
+        handler = BrowserHandler.acquire(self._pool, self.seconds, timeout=timeout, **self.handler_kwargs)
+        try:
+            yield handler
+        finally:
+            # hands the session back to the pool, which resets or replaces it
+            handler.quit()
+
+    def map(self, fn, items):
+        """
+        Calls `fn(handler, item)` for every item, running up to `size` calls in parallel.
+
+        :param fn:
+            - Callable receiving a borrowed BrowserHandler and an item
+        :param items:
+            - Iterable of items, e.g. urls to capture
+        :return:
+            - list of the results, in the order of the items
+        """
+        def run(item):
+            with self.acquire() as handler:
+                return fn(handler, item)
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(run, items))
+
+    def close(self):
+        """
+        Closes all the idle browser handlers of the pool.
+        """
+        self._pool.close()
@@ -1,6 +1,14 @@
 import io
-import sys
+import itertools
+import struct
 from PIL import Image
+try:
+    # libjpeg-turbo, SIMD accelerated JPEG encoding, PIL's encoder is used when it isn't installed
+    import numpy
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbo_jpeg = None
 from wa.core.logging.logger import StandardOutLoggingHandler
 
 """
@@ -9,6 +17,9 @@ does screen shot validations.
 """
 
 log = StandardOutLoggingHandler("wa.browser_handler").get_logger()
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
 class ScreenshotHelper:
     @staticmethod
     def convert_png_jpeg(png_raw_data):
@@ -27,18 +38,22 @@ class ScreenshotHelper:
                Exception: If param  'png_raw_data' validation fails  if screens hot is invalid.
            """
 
-        if ScreenshotHelper.is_valid_screenshot(png_raw_data, 1000):
+        # fails fast on anything that isn't a PNG before it reaches Image.open
+        if ScreenshotHelper.is_valid_screenshot(png_raw_data, 1000) and png_raw_data[:8] == PNG_SIGNATURE:
             stream = io.BytesIO(png_raw_data)
             image = Image.open(stream)
             rgb_im = image.convert('RGB')
+            if _turbo_jpeg is not None:
+                # same quality and chroma subsampling as PIL's defaults
+                return _turbo_jpeg.encode(numpy.asarray(rgb_im), quality=75, pixel_format=TJPF_RGB,
+                                          jpeg_subsample=TJSAMP_420)
             screenshot_data = io.BytesIO()
             rgb_im.save(screenshot_data, format="JPEG")
-            screenshot_data.flush()
-            screenshot_data.seek(0)
-            return screenshot_data.read()
+            return screenshot_data.getvalue()
         else:
             raise Exception(
-                'Invalid  screen shot  to convert  as size could be  either less than 1KB or might be empty')
+                'Invalid  screen shot  to convert  as size could be  either less than 1KB, might be empty or is not '
+                'a PNG')
 
     @staticmethod
     def is_valid_screenshot(p_object, size):
@@ -50,35 +65,55 @@ class ScreenshotHelper:
            """
 
         # Checks if the size is greater than expected size and is not empty
-        if p_object and sys.getsizeof(p_object) > size:
-            return True
-        else:
-            return False
+        return bool(p_object) and len(p_object) > size
+
+    @staticmethod
+    def png_height(png_raw_data):
+        """
+            Reads the image height from the IHDR chunk of a PNG without decoding it.
+               :param : png_raw_data (bytes of the png)
+                Return height in pixels
+           """
+        return struct.unpack('>I', png_raw_data[20:24])[0]
 
     @staticmethod
-    def get_combined_screenshot(slices, width):
+    def get_combined_screenshot(slices, width, total_image_height=None, compress_level=1):
         """
             This function merges the captured screenshot chunks in memory and returns the merged
-            screenshot as bytes IO.
-               :param : slices (chunks of screenshots), offset(total height) ,width
+            screenshot as bytes IO. The merged image is allocated once and every chunk is copied into it and
+            released right away, so the chunks and the merged image are not held in memory together.
+               :param : slices (chunks of screenshots, PIL images or raw PNG bytes), width,
+                        total_image_height (sum of the chunk heights)
+                        When the total height is given, slices can be any iterable, e.g. a generator decoding
+                        the chunks one by one. Raw PNG chunks are decoded only when they are pasted, their
+                        height is read from the PNG header.
+                        compress_level (zlib level of the PNG, 1 is fastest, 9 gives the smallest file)
                 Return screenshot bytes io
            """
 
-        total_image_height = 0
+        if total_image_height is None:
+            # calculating total height of image, from the PNG header for the chunks that are not decoded yet
+            total_image_height = sum(ScreenshotHelper.png_height(img) if isinstance(img, bytes) else img.size[1]
+                                     for img in slices)
 
-        # calculating total height of image
-        for img in slices:
-            total_image_height += img.size[1]
+        # decode the raw chunks lazily so the heights and the pixels are each read in a single pass
+        slices = (Image.open(io.BytesIO(img)) if isinstance(img, bytes) else img for img in slices)
+        first_slice = next(slices)
+        mode = first_slice.mode
 
         # setting the screenshot image height and adding extra 150 to ensure image doesn't crop
-        screenshot = Image.new(slices[0].mode, (width[0], total_image_height + 150))
+        screenshot = Image.new(mode, (width[0], total_image_height + 150))
 
         offset = 0
-        for img in slices:
-            screenshot.paste(img, (0, offset))
-            offset += img.size[1]
+        for img in itertools.chain([first_slice], slices):
+            chunk = img if img.mode == mode else img.convert(mode)
+            screenshot.paste(chunk, (0, offset))
+            offset += chunk.size[1]
+            chunk.close()
+            img.close()
 
+        # the merged image is large and short-lived, fast compression is worth the slightly bigger output unless the
+        # caller asks for a smaller file
         screenshot_data = io.BytesIO()
-        screenshot.save(screenshot_data, format='PNG')
-        screenshot_data.seek(0)
-        return screenshot_data.read()
+        screenshot.save(screenshot_data, format='PNG', compress_level=compress_level, optimize=False)
+        return screenshot_data.getvalue()
@@ -1,13 +1,29 @@
+import functools
 import io
 import json
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
 import time
 from selenium import webdriver
-from methods import get_screenshot_using_cut_and_merger, get_page_height, get_window_height, get_max_height
+from methods import (FIREFOX_MAX_CANVAS_HEIGHT, get_full_page_screenshot, get_screenshot_using_cut_and_merger,
+                     get_page_height, get_window_height, get_max_height)
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the thread lock alone keeps the workers of this process from interleaving
+    fcntl = None
 
-def get_screenshot(wd, full=False, df_wd=1366, df_ht=900, default_height=15000, debug=False, screenshot_delay=20):
+
+def get_screenshot(wd, full=False, df_wd=1366, df_ht=900, default_height=15000, debug=False, screenshot_delay=20,
+                   stitch_pool=None):
     png_ss = None
 
     # Changing the input names to make more semantic sense for now
@@ -23,6 +39,13 @@ def get_screenshot(wd, full=False, df_wd=1366, df_ht=900, default_height=15000,
             if debug:
                 print('GS:: Taking full Screen shot')
             max_height = get_max_height(wd, max_width)
+            if max_height <= FIREFOX_MAX_CANVAS_HEIGHT:
+                if debug:
+                    print(f"GS:: Using Firefox full page capture for height {max_height}")
+                png_ss = get_full_page_screenshot(wd)
+                if png_ss is not None:
+                    return png_ss
+
             if max_height <= cut_merge_threshold:
                 if debug:
                     print(f"GS:: Using Single Screenshot Capture for height {max_height}")
@@ -59,7 +82,8 @@ def get_screenshot(wd, full=False, df_wd=1366, df_ht=900, default_height=15000,
                     print(f"GS:: Using Cut & Merge as Max Height {max_height} "
                           f"exceeds the threshold {cut_merge_threshold}")
 
-                png_ss = get_screenshot_using_cut_and_merger(wd, user_wd, screenshot_delay, debug=True)
+                png_ss = get_screenshot_using_cut_and_merger(wd, user_wd, screenshot_delay, debug=True,
+                                                             stitch_pool=stitch_pool)
         else:
             if debug:
                 print('GS:: Taking customized height screen shot as given by the user')
@@ -80,31 +104,156 @@ def get_screenshot(wd, full=False, df_wd=1366, df_ht=900, default_height=15000,
     return png_ss
 
 
-result = [{
-    "name": "sdfdsf",
-    "value": "sdfsdfdsfsdf",
-    "page_height": "sdfsdf"
-}]
+RESULTS_FILE = "limit_height_urls.jsonl"
+_results_lock = threading.Lock()
 
 
-def process_screenshot(_url):
+def append_result(record):
+    # one JSON object per line, appended under a lock instead of rewriting the whole result list for every match
+    with _results_lock, open(RESULTS_FILE, "a") as fp:
+        if fcntl is not None:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+        fp.write(json.dumps(record) + "\n")
+
+
+GECKODRIVER_PATH = "C:/Users/aman.sainju/Desktop/Aman/geckodriver-v0.33.0-win64/geckodriver.exe"
+POOL_SIZE = 4
+
+# Firefox drivers shared by the workers, started once and recycled across urls. A None entry is a slot whose
+# driver was lost, a new driver is started for it the next time it is taken.
+driver_pool = queue.Queue()
+# Profile directory of every pooled driver, removed when the pool is closed
+driver_profiles = {}
+# Profile holding the cookies, copied for every driver. Set up by init_driver_pool.
+cookie_profile = None
+
+# Processes merging the screenshot slices, set up in __main__. The threads only drive the browsers, the CPU bound
+# stitching runs outside of their GIL.
+stitch_pool = None
+
+
+@functools.lru_cache(maxsize=None)
+def load_cookies():
+    # parsed once for the whole run
+    with open('cookie.json', 'r') as _file:
+        return json.load(_file)
+
+
+def start_firefox(profile_dir):
+    # service = Service(executable_path=GECKODRIVER_PATH)
+    options = webdriver.FirefoxOptions()
+    options.add_argument("-headless")
+    # use the profile in place, so that cookies written by the browser stay in it
+    options.add_argument("-profile")
+    options.add_argument(profile_dir)
+    return webdriver.Firefox(executable_path=GECKODRIVER_PATH, options=options)
+
+
+def create_cookie_profile(cookie_url):
+    # Bakes the cookies into a Firefox profile on disk once, the drivers start from a copy of it already
+    # authenticated instead of adding every cookie and refreshing for each of them.
+    profile_dir = tempfile.mkdtemp(prefix="pagecapture-cookies-")
+    wd = start_firefox(profile_dir)
     try:
-        geckodriver_path = "C:/Users/aman.sainju/Desktop/Aman/geckodriver-v0.33.0-win64/geckodriver.exe"
-        # service = Service(executable_path=geckodriver_path)
-        options = webdriver.FirefoxOptions()
-        options.add_argument("-headless")
-        wd = webdriver.Firefox(executable_path=geckodriver_path, options=options)
-        page_url = _url["value"]
-        # Navigate to a dummy url on the same domain.
-        wd.get(page_url)
+        # Navigate to a dummy url on the same domain, cookies can only be set for the current domain.
+        wd.get(cookie_url)
+        for cookie in load_cookies():
+            # session cookies are dropped when the browser quits, give them an expiry so they are saved
+            wd.add_cookie(dict(cookie, expiry=cookie.get('expiry') or int(time.time()) + 24 * 60 * 60))
+    finally:
+        wd.quit()
+    return profile_dir
+
+
+def create_driver():
+    # a profile can only be used by one Firefox at a time, every driver gets its own copy
+    profile_dir = tempfile.mkdtemp(prefix="pagecapture-profile-")
+    shutil.copytree(cookie_profile, profile_dir, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns("lock", ".parentlock", "parent.lock"))
+    try:
+        wd = start_firefox(profile_dir)
+    except Exception:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        raise
+    driver_profiles[wd] = profile_dir
+    return wd
+
+
+def discard_driver(wd):
+    profile_dir = driver_profiles.pop(wd, None)
+    try:
+        wd.quit()
+    finally:
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+def init_driver_pool(size, cookie_url):
+    global cookie_profile
+    cookie_profile = create_cookie_profile(cookie_url)
+    with ThreadPoolExecutor(max_workers=size) as executor:
+        for wd in executor.map(lambda _: create_driver(), range(size)):
+            driver_pool.put(wd)
+
+
+def acquire_driver():
+    wd = driver_pool.get()
+    if wd is None:
+        try:
+            wd = create_driver()
+        except Exception:
+            # give the slot back so the pool keeps its size, the next task retries
+            driver_pool.put(None)
+            raise
+    return wd
+
+
+def release_driver(wd):
+    # keep the session cookies, they are the authentication shared by all the urls
+    try:
+        wd.get("about:blank")
+    except Exception as e:
+        print(f"replacing broken driver: {e}")
+        try:
+            discard_driver(wd)
+        except Exception as discard_error:
+            print(f"error while discarding driver: {discard_error}")
+        try:
+            wd = create_driver()
+        except Exception as create_error:
+            print(f"couldn't start a replacement driver, retrying on next use: {create_error}")
+            wd = None
+    driver_pool.put(wd)
+
 
-        with open('cookie.json', 'r') as _file:
-            cookies = json.load(_file)
+def close_driver_pool():
+    while not driver_pool.empty():
+        wd = driver_pool.get_nowait()
+        if wd is not None:
+            discard_driver(wd)
+    if cookie_profile:
+        shutil.rmtree(cookie_profile, ignore_errors=True)
 
-        for cookie in cookies:
-            wd.add_cookie(cookie)
 
-        wd.refresh()
+def network_idle(quiet_polls=2):
+    # WebDriverWait condition, true once no resource finished loading in the last 500ms for `quiet_polls`
+    # consecutive polls
+    polls = []
+
+    def condition(driver):
+        recent = driver.execute_script(
+            "return performance.getEntriesByType('resource').filter(r => r.responseEnd > performance.now() - 500)"
+            ".length")
+        polls.append(recent == 0)
+        return len(polls) >= quiet_polls and all(polls[-quiet_polls:])
+    return condition
+
+
+def process_screenshot(_url):
+    wd = acquire_driver()
+    try:
+        page_url = _url["value"]
+        wd.get(page_url)
 
         # Wait for the document to be in a complete ready state
         wait = WebDriverWait(wd, 20)
@@ -113,30 +262,39 @@ def process_screenshot(_url):
 
         # Wait for changes in the document's ready state (you may need to adjust the condition)
         wait.until(lambda driver: wd.execute_script("return document.readyState") == "complete")
-        time.sleep(20)
+
+        # then for the network to go quiet instead of sleeping a fixed 20 seconds
+        try:
+            WebDriverWait(wd, 10, poll_frequency=0.2).until(network_idle())
+        except TimeoutException:
+            print(f"network didn't go idle within 10 seconds: {page_url}")
 
         max_height = get_max_height(wd, 1336)
         if 15000 < max_height < 22000:
-            result.append({"name": _url["name"], "value": page_url, "page_height": max_height})
-            with open("limit_height_urls.json", "w") as fp:
-                json.dump(result, fp)
+            append_result({"name": _url["name"], "value": page_url, "page_height": max_height})
 
-            # ss = get_screenshot(wd, full=True, debug=True)
+            # ss = get_screenshot(wd, full=True, debug=True, stitch_pool=stitch_pool)
         #
         # with open("ss/final_sst_{0}.png".format(_url["name"]), "wb") as fp:
         #     fp.write(ss)
-
-        wd.quit()
     except Exception as e:
         print(f"error while processing: {e}")
         raise e
+    finally:
+        release_driver(wd)
 
 
 if __name__ == '__main__':
     with open("new_franklin_urls.json", "r") as file:
         urls = json.load(file)
     # page_domain = 'https://www.franklintempleton.com'
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = []
-        for _url in urls:
-            futures.append(executor.submit(process_screenshot, _url))
+    init_driver_pool(POOL_SIZE, urls[0]["value"])
+    stitch_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with ThreadPoolExecutor(max_workers=POOL_SIZE) as executor:
+            futures = []
+            for _url in urls:
+                futures.append(executor.submit(process_screenshot, _url))
+    finally:
+        stitch_pool.shutdown()
+        close_driver_pool()
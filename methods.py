@@ -1,69 +1,164 @@
+import base64
 import io
 import math
+import struct
 import time
+import weakref
 from PIL import Image
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
 
 
-def get_max_height(wd, max_width=1367):
-    max_height = 0
+# page heights closer than this are considered settled by get_max_height
+MAX_HEIGHT_EPSILON = 50
 
-    while True:
-        previous_max_height = get_page_height(wd)
+
+def _height_stable(heights):
+    # WebDriverWait condition, true once the document is loaded and two consecutive polls measured the same height.
+    # The measured heights are appended to `heights` so the caller can reuse the last one.
+    def condition(driver):
+        if driver.execute_script("return document.readyState") != "complete":
+            return False
+        heights.append(get_page_height(driver))
+        return len(heights) > 1 and heights[-1] == heights[-2]
+    return condition
+
+
+def get_max_height(wd, max_width=1367, max_iterations=5, timeout=25):
+    max_height = get_page_height(wd)
+
+    # bounded so that infinite scroll pages don't keep us here forever
+    for _ in range(max_iterations):
+        previous_max_height = max_height
         print(f"previous_max_height {previous_max_height}")
         wd.set_window_size(max_width, previous_max_height)
         wd.execute_script("window.scrollTo(0, {0})".format(previous_max_height))
-        time.sleep(20)
-        new_max_height = get_page_height(wd)
-        print(f"new_max_height {new_max_height}")
+
+        heights = []
+        try:
+            WebDriverWait(wd, timeout, poll_frequency=0.5).until(_height_stable(heights))
+        except TimeoutException:
+            print(f"page height didn't settle within {timeout} seconds")
+
+        new_max_height = heights[-1] if heights else get_page_height(wd)
         print(f"prev_max_height: {previous_max_height}, new_max_height: {new_max_height}")
-        if previous_max_height == new_max_height:
-            max_height = new_max_height
+        max_height = max(previous_max_height, new_max_height)
+
+        # some pages keep oscillating by a few pixels (sticky footers), that doesn't matter for the screenshot
+        if abs(new_max_height - previous_max_height) < MAX_HEIGHT_EPSILON:
+            if new_max_height != previous_max_height:
+                print(f"height settled within {MAX_HEIGHT_EPSILON}px: {previous_max_height} -> {new_max_height}")
             break
     return max_height
 
 
-def get_window_height(wd, viewport):
-    return viewport + wd.execute_script("return window.outerHeight - window.innerHeight")
+# browser chrome height (outerHeight - innerHeight) per driver, it doesn't change for a given driver, OS and zoom.
+# Weak keys so that quitting a driver doesn't leave it in the cache.
+_chrome_delta_cache = weakref.WeakKeyDictionary()
 
 
-def get_page_height(wd):
-    scroll_height = int(wd.execute_script('return document.body.scrollHeight'))
-    client_height = int(wd.execute_script('return document.body.clientHeight'))
-    offset_height = int(wd.execute_script('return document.body.offsetHeight'))
-    document_offset_height = int(wd.execute_script('return document.documentElement.offsetHeight'))
-    document_client_height = int(wd.execute_script('return document.documentElement.clientHeight'))
-    document_scroll_height = int(wd.execute_script('return document.documentElement.scrollHeight'))
-
-    # find max height of the current page
-    max_height = max([scroll_height, client_height, offset_height, document_scroll_height, document_client_height,
-                      document_offset_height])
+def get_chrome_delta(wd):
+    chrome_delta = _chrome_delta_cache.get(wd)
+    if chrome_delta is None:
+        chrome_delta = _chrome_delta_cache[wd] = wd.execute_script("return window.outerHeight - window.innerHeight")
+    return chrome_delta
+
+
+def get_window_height(wd, viewport, chrome_delta=None):
+    if chrome_delta is None:
+        chrome_delta = get_chrome_delta(wd)
+    return viewport + chrome_delta
+
+
+def get_page_metrics(wd):
+    # single round trip for the max height of the current page and the browser chrome height
+    max_height, chrome_delta = wd.execute_script("""
+        const b = document.body, d = document.documentElement;
+        return [Math.max(b.scrollHeight, b.clientHeight, b.offsetHeight, d.scrollHeight, d.clientHeight,
+                         d.offsetHeight),
+                window.outerHeight - window.innerHeight];
+    """)
     print(f"found max height: {max_height}")
+    _chrome_delta_cache[wd] = int(chrome_delta)
 
-    return max_height
+    return int(max_height), int(chrome_delta)
+
+
+def get_page_height(wd):
+    return get_page_metrics(wd)[0]
 
 
-def get_combined_screenshot(slices, width):
-    total_height = 0
+# Firefox can't render a canvas taller than this, longer pages have to be cut and merged
+FIREFOX_MAX_CANVAS_HEIGHT = 32767
 
+
+def get_full_page_screenshot(wd):
+    # geckodriver renders the whole document in a single call, the stitching happens inside Firefox. Returns None
+    # when the driver doesn't support it so the caller can fall back to cut and merge.
+    commands = wd.command_executor._commands
+    if 'FULL_PAGE_SCREENSHOT' not in commands:
+        commands['FULL_PAGE_SCREENSHOT'] = ('GET', '/session/$sessionId/moz/screenshot/full')
+
+    try:
+        return base64.b64decode(wd.execute('FULL_PAGE_SCREENSHOT')['value'])
+    except WebDriverException as e:
+        print(f"full page screenshot not supported: {e}")
+        return None
+
+
+def png_height(raw_png):
+    # image height straight from the IHDR chunk of the PNG, no decoding needed
+    return struct.unpack('>II', raw_png[16:24])[1]
+
+
+def decode_slices(ss_chunks):
+    # decodes the (raw_png, height) slices one at a time while they are merged, dropping the encoded bytes as we go
+    while ss_chunks:
+        raw_png, _ = ss_chunks.pop(0)
+        yield Image.open(io.BytesIO(raw_png))
+
+
+def merge_png_slices(ss_chunks, width, compress_level=1):
+    # decodes and merges (raw_png, height) slices, module level so it can run in a ProcessPoolExecutor
+    total_height = sum(img_height for _, img_height in ss_chunks)
+    return get_combined_screenshot(decode_slices(ss_chunks), width, total_height, compress_level)
+
+
+def get_combined_screenshot(slices, width, total_height=None, compress_level=1):
+    # slices can be a generator decoding the screenshots lazily when total_height is given, otherwise it has to be a
+    # list so the height can be summed before pasting. Raw PNG slices are decoded only when they are pasted, their
+    # height comes from the PNG header.
     try:
-        # calculating total image height
-        for image in slices:
-            total_height += image.height
+        if total_height is None:
+            # calculating total image height
+            total_height = sum(png_height(image) if isinstance(image, bytes) else image.height for image in slices)
 
         # adding more extra 150px image screenshot height
-        screenshot = Image.new(slices[0].mode, (width[0], total_height + 150))
+        size = (width[0], total_height + 150)
+
+        # refuse absurd sizes before allocating the canvas, same guard PIL applies when opening images
+        Image._decompression_bomb_check(size)
 
+        screenshot = None
         offset = 0
 
-        for img in slices:
+        for index, img in enumerate(slices):
+            if isinstance(img, bytes):
+                img = Image.open(io.BytesIO(img))
+            if screenshot is None:
+                screenshot = Image.new(img.mode, size)
             screenshot.paste(img, (0, offset))
             offset += img.height
 
-        screenshot_data = io.BytesIO()
-        screenshot.save(screenshot_data, format='PNG')
-        screenshot_data.seek(0)
+            # release every slice as soon as it is pasted so only the canvas stays in memory
+            img.close()
+            if isinstance(slices, list):
+                slices[index] = None
 
-        return screenshot_data.read()
+        screenshot_data = io.BytesIO()
+        # zlib level 1 encodes several times faster than the default 6 for a slightly bigger file
+        screenshot.save(screenshot_data, format='PNG', compress_level=compress_level, optimize=False)
+        return screenshot_data.getvalue()
     except Exception as e:
         raise e
 
@@ -80,14 +175,18 @@ def capture_remaining_page(wd, ss_chunks, total_height, win_width, viewport, scr
 
         print(f"CRP:: Taking final screenshot")
 
-        # modifying the height to ensure that the max page height is constant.
-        wd.execute_script("return document.body.style.height = {0}+'px'".format(total_height))
-
         # gives latest offset data
-        scroll_offset = ss_chunks[0].height * len(ss_chunks)
+        scroll_offset = ss_chunks[0][1] * len(ss_chunks)
+
+        # modifying the height to ensure that the max page height is constant, reading the browser chrome height in
+        # the same call
+        chrome_delta = wd.execute_script("""
+            document.body.style.height = arguments[0] + 'px';
+            return window.outerHeight - window.innerHeight;
+            """, total_height)
 
         # new height to resize window to get last remaining page with more accuracy
-        new_win_height = get_window_height(wd, remaining_page_height)
+        new_win_height = get_window_height(wd, remaining_page_height, chrome_delta)
 
         # resizing the window size for remaining section
         wd.set_window_size(win_width, new_win_height)
@@ -95,20 +194,24 @@ def capture_remaining_page(wd, ss_chunks, total_height, win_width, viewport, scr
 
         time.sleep(screenshot_delay)
 
-        # scrolling page to the bottom offset to the remaining section
-        wd.execute_script("window.scrollTo({0}, {1})".format(scroll_x, scroll_offset))
+        # scrolling page to the bottom offset to the remaining section, only once the window has shrunk, the window
+        # is as tall as the page before that so there is nothing to scroll
+        wd.execute_script("window.scrollTo(arguments[0], arguments[1])", scroll_x, scroll_offset)
 
         time.sleep(screenshot_delay)
 
-        image = Image.open(io.BytesIO(wd.get_screenshot_as_png()))
+        raw_png = wd.get_screenshot_as_png()
 
-        return image
+        return raw_png, png_height(raw_png)
     except Exception as e:
         print(f"error-capture-remaining-page {e}")
         raise e
 
 
-def get_screenshot_using_cut_and_merger(wd, win_width, screenshot_delay, debug=False, win_height=15000):
+def get_screenshot_using_cut_and_merger(wd, win_width, screenshot_delay, debug=False, win_height=15000,
+                                        stitch_pool=None):
+    # stitch_pool is an optional ProcessPoolExecutor, merging the slices is CPU bound and would otherwise hold the
+    # GIL of the threads driving the other browsers
     ss_chunks = []
     offset = 0
     scroll_x = 0
@@ -119,11 +222,13 @@ def get_screenshot_using_cut_and_merger(wd, win_width, screenshot_delay, debug=F
     print(f"found new page height: {max_height}")
 
     wd.set_window_size(win_width, max_height)
-    print(f"window size {win_width}x{wd.execute_script("return window.outerHeight")}")
     time.sleep(screenshot_delay)
 
-    viewport = wd.execute_script("return window.innerHeight")
-    print(f"viewport height {viewport}")
+    # viewport, window and document heights in a single round trip
+    viewport, outer_height, scroll_height = wd.execute_script(
+        "return [window.innerHeight, window.outerHeight, document.documentElement.scrollHeight]")
+    print(f"window size {win_width}x{outer_height}")
+    print(f"viewport height {viewport}, document height {scroll_height}")
 
     max_ss_count = math.floor(max_height / viewport)
     print(f"CM:: total possible screenshot excluding last remaining screenshot: {max_ss_count}")
@@ -136,17 +241,23 @@ def get_screenshot_using_cut_and_merger(wd, win_width, screenshot_delay, debug=F
         # Setting the window to the appropriate offset
         if debug:
             print(f"CM:: Scrolling to {scroll_x}x{offset}")
-        wd.execute_script("window.scrollTo({0}, {1})".format(scroll_x, offset))
+        # scrolling and reading back the actual position in the same call
+        scroll_y = wd.execute_script("window.scrollTo(arguments[0], arguments[1]); return window.scrollY;",
+                                     scroll_x, offset)
+        if round(scroll_y) != offset:
+            print(f"CM:: Page stopped scrolling at {scroll_y} instead of {offset}")
         time.sleep(screenshot_delay)
 
-        img = Image.open(io.BytesIO(wd.get_screenshot_as_png()))
+        # keep the encoded screenshot, it is decoded only once when the slices are merged
+        raw_png = wd.get_screenshot_as_png()
+        img_height = png_height(raw_png)
 
         # always get the offset from the image height to get the next position with accuracy
-        offset += img.height
+        offset += img_height
         if debug:
             print(f"CM:: New Height Offset is {offset}")
 
-        ss_chunks.append(img)
+        ss_chunks.append((raw_png, img_height))
 
         total_ss_count += 1
 
@@ -158,7 +269,10 @@ def get_screenshot_using_cut_and_merger(wd, win_width, screenshot_delay, debug=F
         ss_chunks.append(last_image)
 
     width = [int(window_width)]
-    png_ss = get_combined_screenshot(ss_chunks, width)
+    if stitch_pool is not None:
+        png_ss = stitch_pool.submit(merge_png_slices, ss_chunks, width).result()
+    else:
+        png_ss = merge_png_slices(ss_chunks, width)
 
     return png_ss
 